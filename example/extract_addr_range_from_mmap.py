@@ -1,8 +1,117 @@
 import argparse
+import itertools
 import json
+import mmap
 import os
 import re
 
+# map maps files at least this big instead of reading them into memory
+MMAP_MIN_SIZE = 16 * mmap.PAGESIZE
+# only use the JIT-compiled merge for paths with at least this many ranges
+JIT_MIN_RANGES = 10_000
+
+# (np, kernel) once _load_merge_jit() has run, kernel is None without numba
+_merge_jit = None
+
+
+def _load_merge_jit():
+    """
+    Import numpy/numba and compile the merge kernel on first use, so the
+    common small maps file never pays for the import.
+    """
+    global _merge_jit
+    if _merge_jit is not None:
+        return _merge_jit
+    try:
+        import numpy as np
+        from numba import njit
+    except ImportError:
+        _merge_jit = (None, None)
+        return _merge_jit
+
+    @njit(cache=True)
+    def merge_sorted_jit(starts, ends):
+        out_starts = np.empty_like(starts)
+        out_ends = np.empty_like(ends)
+        count = 0
+        for i in range(starts.shape[0]):
+            if count > 0 and starts[i] <= out_ends[count - 1]:
+                if ends[i] > out_ends[count - 1]:
+                    out_ends[count - 1] = ends[i]
+            else:
+                out_starts[count] = starts[i]
+                out_ends[count] = ends[i]
+                count += 1
+        return out_starts[:count], out_ends[:count]
+
+    _merge_jit = (np, merge_sorted_jit)
+    return _merge_jit
+
+
+def merge_sorted_ranges(ranges):
+    """
+    Merge contiguous/overlapping (start, end) ranges that are sorted by start.
+
+    Returns:
+      list of [start, end]
+    """
+    if len(ranges) >= JIT_MIN_RANGES:
+        np, merge_sorted_jit = _load_merge_jit()
+        if merge_sorted_jit is not None:
+            # uint64 since kernel addresses do not fit in int64
+            starts = np.fromiter(
+                (start for start, _ in ranges),
+                dtype=np.uint64, count=len(ranges)
+            )
+            ends = np.fromiter(
+                (end for _, end in ranges), dtype=np.uint64, count=len(ranges)
+            )
+            out_starts, out_ends = merge_sorted_jit(starts, ends)
+            return [
+                [start, end]
+                for start, end in zip(out_starts.tolist(), out_ends.tolist())
+            ]
+
+    merged_list = []
+    for start, end in ranges:
+        if merged_list and start <= merged_list[-1][1]:
+            # extend end if overlapping or contiguous
+            merged_list[-1][1] = max(merged_list[-1][1], end)
+        else:
+            merged_list.append([start, end])
+    return merged_list
+
+
+def _matching_ranges(lines, binary_path_b, lib_re):
+    """
+    Yield (path, start, end) for the lines of a maps file that belong to the
+    binary or match one of the sync library patterns.
+    """
+    for line in lines:
+        # each line: start-end perms offset dev inode path
+        # the path is optional and may itself contain spaces
+        parts = line.rstrip(b"\n").split(None, 5)
+        if len(parts) < 6:
+            # no path: anonymous mapping, cannot be the binary or a library
+            continue
+        range_str, perms, _off, _dev, _inode, path = parts
+        start_s, sep, end_s = range_str.partition(b"-")
+        if not sep:
+            continue
+
+        # match exact binary path and permission, or any sync lib pattern.
+        # the patterns are meant for the file name, so a hit anywhere in the
+        # path is confirmed against the basename before it counts
+        if (path == binary_path_b and b"x" in perms) or (
+            lib_re is not None
+            and lib_re.search(path)
+            and lib_re.search(os.path.basename(path))
+        ):
+            start = int(start_s, 16)
+            end   = int(end_s,   16)
+            yield os.fsdecode(path), start, end
+
+
 def parse_and_merge_maps(maps_path, binary_path, sync_lib_patterns):
     """
     Read the process memory map file and extract executable code ranges
@@ -10,70 +119,91 @@ def parse_and_merge_maps(maps_path, binary_path, sync_lib_patterns):
 
     Returns:
       dict[
-      "loop_range": list of (start_hex, end_hex),
+      "loop_range": (start, end),
       "excluded": dict[
-            path -> list of (start_hex, end_hex)
+            path -> list of (start, end)
+        ],
+      "excluded_flat": dict[
+            "paths": list of path,
+            "path_ids": list of index into "paths",
+            "starts": list of start,
+            "ends": list of end
         ]
       ]
       where:
         - "loop_range" contains the executable code ranges for the main binary
         - "excluded" contains regions for the libraries that we should excluded 
             with their respective paths and ranges.
+        - "excluded_flat" contains the same regions as "excluded" as parallel
+            lists, so they can be loaded without walking the nested map.
+      All addresses are integers. Use to_hex_view() for a human readable
+      version.
     """
-    # regex to parse each line: start-end perms offset dev inode path
-    line_re = re.compile(
-        r"^([0-9A-Fa-f]+)-([0-9A-Fa-f]+)\s+"  # start-end
-        r"(\S+)\s+"                           # perms
-        r"\S+\s+\S+\s+\S+\s*"                  # offset, dev, inode
-        r"(.*)$"                               # path (may be blank)
-    )
+    # compare raw bytes while scanning and only decode the paths we keep
+    binary_path_b = os.fsencode(binary_path)
+    # one alternation scan instead of testing every pattern in turn
+    lib_re = re.compile(
+        b"|".join(re.escape(os.fsencode(lib)) for lib in sync_lib_patterns)
+    ) if sync_lib_patterns else None
 
-    raw = {}
-    with open(maps_path, "r") as f:
-        for line in f:
-            m = line_re.match(line)
-            if not m:
-                continue
-            start_s, end_s, perms, path = m.groups()
-
-            name = os.path.basename(path)
-            # match exact binary path and permission, or any sync lib pattern
-            if (path == binary_path and "x" in perms) or \
-                    any(lib in name for lib in sync_lib_patterns):
-                start = int(start_s, 16)
-                end   = int(end_s,   16)
-                raw.setdefault(path, []).append((start, end))
-
-    # merge contiguous/overlapping ranges
+    with open(maps_path, "rb") as f:
+        # a saved dump is read whole in one call (or mapped if it is big) so
+        # we parse a consistent snapshot. a live /proc/<pid>/maps reports a
+        # size of 0 and always takes the read() path
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                entries = list(_matching_ranges(
+                    iter(mm.readline, b""), binary_path_b, lib_re
+                ))
+        else:
+            entries = list(_matching_ranges(
+                f.read().split(b"\n"), binary_path_b, lib_re
+            ))
+
+    # sort once by (path, start), then merge the ranges of each path
+    entries.sort()
     merged = {}
-    for path, regions in raw.items():
-        regions.sort(key=lambda x: x[0])
-        merged_list = []
-        for start, end in regions:
-            if not merged_list:
-                merged_list.append([start, end])
-            else:
-                last = merged_list[-1]
-                if start <= last[1]:
-                    # extend end if overlapping or contiguous
-                    last[1] = max(last[1], end)
-                else:
-                    merged_list.append([start, end])
+    excluded = {}
+    excluded_flat = {"paths": [], "path_ids": [], "starts": [], "ends": []}
+    for path, group in itertools.groupby(entries, key=lambda x: x[0]):
+        merged_list = merge_sorted_ranges(
+            [(start, end) for _, start, end in group]
+        )
         if path == binary_path:
-            merged["loop_range"] = (
-                f"{merged_list[0][0]:016x}",
-                f"{merged_list[0][1]:016x}"
-            )
-        else:
-            if "excluded" not in merged:
-                merged["excluded"] = {}
-            merged["excluded"][path] = [
-                (f"{r[0]:016x}", f"{r[1]:016x}") for r in merged_list
-            ]
+            merged["loop_range"] = tuple(merged_list[0])
+            continue
+        excluded[path] = [tuple(r) for r in merged_list]
+        path_id = len(excluded_flat["paths"])
+        excluded_flat["paths"].append(path)
+        excluded_flat["path_ids"].extend([path_id] * len(merged_list))
+        excluded_flat["starts"].extend(start for start, _ in merged_list)
+        excluded_flat["ends"].extend(end for _, end in merged_list)
+
+    if excluded:
+        merged["excluded"] = excluded
+        merged["excluded_flat"] = excluded_flat
 
     return merged
 
 
+def to_hex_view(merged):
+    """
+    Returns the "loop_range" and "excluded" ranges of parse_and_merge_maps()
+    with every address formatted as a 16 digit hex string.
+    """
+    hex_view = {}
+    if "loop_range" in merged:
+        hex_view["loop_range"] = tuple(
+            f"{addr:016x}" for addr in merged["loop_range"]
+        )
+    if "excluded" in merged:
+        hex_view["excluded"] = {
+            path: [(f"{start:016x}", f"{end:016x}") for start, end in ranges]
+            for path, ranges in merged["excluded"].items()
+        }
+    return hex_view
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Extract and merge exec code ranges from a saved mmap dump"
@@ -101,6 +231,13 @@ def main():
             "(default: extracted_addr_ranges.json)"
         )
     )
+    parser.add_argument(
+        "--hex", action="store_true",
+        help=(
+            "Also save the address ranges as hex strings under \"hex_view\" "
+            "for human inspection"
+        )
+    )
     args = parser.parse_args()
 
     if not os.path.isfile(args.maps_file):
@@ -110,6 +247,8 @@ def main():
     if not merged:
         print("No matching executable regions found.")
         return
+    if args.hex:
+        merged["hex_view"] = to_hex_view(merged)
 
     with open(args.output, "w") as f:
         json.dump(merged, f, indent=2)
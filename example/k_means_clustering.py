@@ -1,10 +1,32 @@
 import json
 from typing import Dict, List
 from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import numpy as np
 
+try:
+    # orjson decodes the large BBV maps much faster than the json module
+    import orjson
+except ImportError:
+    orjson = None
+
 random_seed = 627
+# use mini-batch k-means once there are more regions than this
+minibatch_threshold = 10_000
+
+def load_looppoint_analysis_output(path: str) -> Dict[str, Dict]:
+    """
+    Reads the NDJSON output of looppoint_analysis.py, where every line is a
+    JSON object mapping one region ID to that region's data.
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    output: Dict[str, Dict] = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                output.update(loads(line))
+    return output
+
 
 def form_bb_id_map(bb_inst_map: Dict[str, int]) -> Dict[str, int]:
     """
@@ -15,55 +37,61 @@ def form_bb_id_map(bb_inst_map: Dict[str, int]) -> Dict[str, int]:
 
 def from_bb_id_inst_array(
     bb_id_map: Dict[str, int], bb_inst_map: Dict[str, int]
-) -> List[int]:
+) -> np.ndarray:
     """
     Creates an array where each index corresponds to a basic block ID
     and holds the static instruction count for that block.
     """
-    inst_array = [0] * len(bb_id_map)
-    for addr, inst_count in bb_inst_map.items():
-        inst_array[bb_id_map[addr]] = int(inst_count)
-    return inst_array
+    # bb_id_map is built from bb_inst_map, so its keys are in ID order
+    return np.fromiter(
+        map(bb_inst_map.__getitem__, bb_id_map),
+        dtype=np.int64,
+        count=len(bb_id_map)
+    )
 
 
 def form_weighted_bbv_array(
     raw_bbv: Dict[str, int],
     bb_id_map: Dict[str, int],
-    bb_inst_array: List[int]
-) -> List[int]:
+    bb_inst_array: np.ndarray
+) -> np.ndarray:
     """
     Computes a weighted basic block vector (BBV) by multiplying execution counts
     with the static instruction counts per basic block.
     """
-    weighted_bbv = [0] * len(bb_id_map)
-    for addr, count in raw_bbv.items():
-        bb_id = bb_id_map[addr]
-        weighted_bbv[bb_id] = int(count * bb_inst_array[bb_id])
+    ids = np.fromiter(
+        map(bb_id_map.__getitem__, raw_bbv),
+        dtype=np.int64,
+        count=len(raw_bbv)
+    )
+    counts = np.fromiter(raw_bbv.values(), dtype=np.int64, count=len(raw_bbv))
+    weighted_bbv = np.zeros(len(bb_id_map), dtype=np.int64)
+    weighted_bbv[ids] = counts * bb_inst_array[ids]
     return weighted_bbv
 
 
-def format_bbvs(output: Dict[str, Dict]) -> List[List[float]]:
+def format_bbvs(output: Dict[str, Dict]) -> np.ndarray:
     """
     Processes a set of regional BBVs into normalized weighted BBVs.
     """
+    # Look up every region by its ID once and walk them in order
+    regions = [output[str(region_id)] for region_id in range(len(output))]
+
     # Use the final region to extract the full bb_inst_map
-    final_region_key = str(len(output) - 1)
-    bb_inst_map = output[final_region_key]["bb_inst_map"]
+    bb_inst_map = regions[-1]["bb_inst_map"]
 
     bb_id_map = form_bb_id_map(bb_inst_map)
     bb_inst_array = from_bb_id_inst_array(bb_id_map, bb_inst_map)
 
-    bbvs: List[List[float]] = []
-    for region_id in range(len(output)):
-        region_data = output[str(region_id)]
+    bbvs = np.empty((len(regions), len(bb_id_map)), dtype=np.float64)
+    for region_id, region_data in enumerate(regions):
         raw_bbv = region_data["global_bbv"]
         region_length = region_data["global_length"]
 
         weighted_bbv = form_weighted_bbv_array(raw_bbv, bb_id_map, bb_inst_array)
-        normalized_bbv = [x / region_length for x in weighted_bbv]
-        bbvs.append(normalized_bbv)
+        np.divide(weighted_bbv, region_length, out=bbvs[region_id])
 
-    return np.array(bbvs)
+    return bbvs
 
 def reduce_data_dim_with_pca(
     bbvs: List[List[float]], n_components: int = 15
@@ -83,7 +111,23 @@ def k_means_clustering(
     Applies K-means clustering to the BBVs.
     """
 
-    kmeans = KMeans(n_clusters=n_clusters, random_state=random_seed)
+    # A single seeded initialization is enough for SimPoint-style BBV
+    # clustering and avoids repeating the full fit n_init times.
+    if len(bbvs) > minibatch_threshold:
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            batch_size=1024,
+            n_init=1,
+            random_state=random_seed
+        )
+    else:
+        kmeans = KMeans(
+            n_clusters=n_clusters,
+            n_init=1,
+            algorithm="elkan",
+            copy_x=False,
+            random_state=random_seed
+        )
     kmeans.fit(bbvs)
     labels = kmeans.labels_
     centers = kmeans.cluster_centers_
@@ -98,8 +142,10 @@ def find_representative_regions(
     representative_regions: Dict[int, List[int]] = {}
     for i in range(len(centers)):
         cluster_indices = np.where(labels == i)[0]
-        distances = np.linalg.norm(bbvs[cluster_indices] - centers[i], axis=1)
-        closest_index = cluster_indices[np.argmin(distances)]
+        # squared distances have the same argmin and skip the sqrt
+        diff = bbvs[cluster_indices] - centers[i]
+        sq_distances = np.einsum("ij,ij->i", diff, diff)
+        closest_index = cluster_indices[np.argmin(sq_distances)]
         if i not in representative_regions:
             representative_regions[i] = []
         representative_regions[i].append(closest_index)
@@ -22,6 +22,13 @@ from m5.objects import LooppointAnalysis, LooppointAnalysisManager, AddrRange
 import json
 import m5
 
+try:
+    # orjson encodes the large BBV maps much faster than the json module,
+    # but it is not always available in gem5's Python environment.
+    import orjson
+except ImportError:
+    orjson = None
+
 parser = argparse.ArgumentParser(
     description=(
         "Run a simulation with LoopPoint Analysis to analyze loop execution"
@@ -69,10 +76,11 @@ parser.add_argument(
 )
 parser.add_argument(
     "-o", "--output-json-file-path",
-    type=str, default="loop_point_analysis_output.json",
+    type=str, default="loop_point_analysis_output.ndjson",
     help=(
-        "Path to the output JSON file where the LoopPoint Analysis results "
-        "will be saved. Default is 'loop_point_analysis_output.json'."
+        "Path to the output NDJSON file where the LoopPoint Analysis results "
+        "will be saved, one JSON object per region and line. "
+        "Default is 'loop_point_analysis_output.ndjson'."
     )
 )
     
@@ -94,9 +102,10 @@ checkpoint_store_path = Path(args.checkpoint_store_path) if args.checkpoint_stor
 region_length = args.region_length
 
 output_file = Path(args.output_json_file_path)
-with open(output_file, "w") as f:
-    # Initialize the output file with an empty JSON object
-    json.dump({}, f)
+# Truncate the output file, then keep it open for appending. Every region is
+# written to it as one JSON line as soon as it finishes.
+open(output_file, "wb").close()
+output_fh = open(output_file, "ab")
 
 # ================ System configuration starts ================
 num_threads = 2
@@ -169,24 +178,27 @@ with open(extracted_addr_ranges_json_file_path, 'r') as f:
     extracted_ranges = json.load(f)
 
 loop_range = extracted_ranges["loop_range"]
-loop_range = AddrRange(start=int(loop_range[0],16), end=int(loop_range[1],16))
-excluded_ranges = []
-
-for lib_path, addr_ranges in extracted_ranges["excluded"].items():
-    for addr_range in addr_ranges:
-        excluded_ranges.append(
-            AddrRange(start=int(addr_range[0], 16), end=int(addr_range[1], 16))
-        )
+loop_range = AddrRange(start=loop_range[0], end=loop_range[1])
+excluded_flat = extracted_ranges["excluded_flat"]
+excluded_ranges = [
+    AddrRange(start=start, end=end)
+    for start, end in zip(excluded_flat["starts"], excluded_flat["ends"])
+]
+# AddrRange(0, 0) means every address is valid for the basic block analysis
+bb_valid_range = AddrRange(0, 0)
 
 manager = LooppointAnalysisManager()
 manager.region_length = region_length
 
 all_trackers = []
 
+# The ranges are built once above and the same objects are handed to every
+# tracker. gem5 only wraps the excluded list in a new vector parameter per
+# tracker, it does not rebuild the AddrRanges inside it.
 for core in board.get_processor().get_cores():
     tracker = LooppointAnalysis()
     tracker.looppoint_analysis_manager = manager
-    tracker.bb_valid_addr_range = AddrRange(0, 0)
+    tracker.bb_valid_addr_range = bb_valid_range
     tracker.marker_valid_addr_range = loop_range
     tracker.bb_excluded_addr_ranges = excluded_ranges
     if not start_tracking:
@@ -200,21 +212,22 @@ for core in board.get_processor().get_cores():
 
 region_id = 0
 
-def to_hex_map(the_map):
-    new_map = {}
-    for key, value in the_map.items():
-        new_map[hex(key)] = value
-    return new_map
+def encode_json(data):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data).encode()
 
 def get_data(dump_bb_inst_map):
     global region_id
+    global output_fh
     global manager
     global all_trackers
 
-    global_bbv = manager.getGlobalBBV()
-    global_bbv = to_hex_map(global_bbv)
-
-    loop_counter = to_hex_map(manager.getBackwardBranchCounter())
+    # build the hex-keyed maps directly from the maps gem5 returns
+    global_bbv = {hex(k): v for k, v in manager.getGlobalBBV().items()}
+    loop_counter = {
+        hex(k): v for k, v in manager.getBackwardBranchCounter().items()
+    }
     most_recent_loop = hex(manager.getMostRecentBackwardBranchPC())
 
     region_info = {
@@ -225,18 +238,18 @@ def get_data(dump_bb_inst_map):
         "most_recent_loop_count" : manager.getMostRecentBackwardBranchCount()
     }
     if dump_bb_inst_map:
-        region_info["bb_inst_map"] = to_hex_map(manager.getBBInstMap())
+        region_info["bb_inst_map"] = {
+            hex(k): v for k, v in manager.getBBInstMap().items()
+        }
 
     for tracker in all_trackers:
         tracker.clearLocalBBV()
 
     manager.clearGlobalBBV()
     manager.clearGlobalInstCounter()
-    with open(output_file, "r") as f:
-        data = json.load(f)
-    data[region_id] = region_info
-    with open(output_file, "w") as f:
-        json.dump(data, f, indent=4)
+    output_fh.write(encode_json({region_id: region_info}) + b"\n")
+    # flush so the finished regions survive if the simulation dies early
+    output_fh.flush()
     region_id += 1
     return region_id
 
@@ -264,12 +277,14 @@ def workbegin_handler():
 
 def workend_handler():
     global all_trackers
+    global output_fh
     print("Stopping LoopPoint Analysis trackers.")
     for tracker in all_trackers:
         tracker.stopListening()
     print("get to the end of the workload")
     current_region_id = get_data(True)
     print(f"Region {current_region_id-1} finished")
+    output_fh.close()
     yield True
 
 # ================ Exit event handler ends ================